@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from . import models
-from . import wizard
\ No newline at end of file
+from . import wizard
+from . import report
\ No newline at end of file
@@ -9,7 +9,7 @@
     """,
     'author': "Pymtech Solutions",
     'category': 'Sales/School/Industries',
-    'version': '18.0.0.4',
+    'version': '18.0.0.5',
     'depends': ['base', 'hr', 'contacts', 'product', 'mail', 'calendar', 'web'],
     'data': [
         'security/school_security.xml',
@@ -28,13 +28,23 @@
         'views/parent_views.xml',
         'views/material_movement_views.xml',
         'views/boxes_views.xml',
+        'report/school_box_reconciliation_report_views.xml',
+        'views/material_forecast_views.xml',
+        'views/enrollment_history_views.xml',
         'data/cron_attendance.xml',
+        'data/cron_material_snapshot.xml',
+        'data/cron_material_forecast.xml',
+        'data/enrollment_history_data.xml',
+        'data/cron_enrollment_state.xml',
         'views/course_line_views.xml',
         'views/program_views.xml',
         'views/schedule_views.xml',
 		'views/product_template_views.xml',
         'wizard/adjust_box_material_views.xml',
         'wizard/attendance_adjust_box_material_views.xml',
+        'wizard/attendance_backfill_views.xml',
+        'wizard/import_material_movement_views.xml',
+        'wizard/replenishment_planner_views.xml',
 		'views/attendance_line_views.xml',
 		'views/school_subject_views.xml',
 ],
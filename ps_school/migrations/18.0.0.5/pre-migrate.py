@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Merge the duplicated attendances of a same (date, course_line_id) pair, so the unique constraint
+    of school.attendance can be created. The attendance kept is the closed one, else the one with
+    students marked as attended, else the one with material movements, else the oldest. Movements,
+    attended marks and student lines missing from it are moved from the duplicates, which are
+    then removed.
+    """
+    if not version:
+        return
+
+    cr.execute("""
+        CREATE TEMP TABLE attendance_duplicate ON COMMIT DROP AS
+        SELECT id, keeper_id
+          FROM (
+                SELECT attendance.id,
+                       first_value(attendance.id) OVER (
+                            PARTITION BY attendance.date, attendance.course_line_id
+                                ORDER BY attendance.materials_status = 'closed' DESC,
+                                         EXISTS (SELECT 1 FROM school_attendance_line line
+                                                  WHERE line.attendance_id = attendance.id
+                                                    AND line.attended) DESC,
+                                         EXISTS (SELECT 1 FROM school_material_movement movement
+                                                  WHERE movement.attendance_id = attendance.id) DESC,
+                                         attendance.id
+                       ) AS keeper_id
+                  FROM school_attendance attendance
+               ) ranked
+         WHERE id != keeper_id
+    """)
+    cr.execute("SELECT COUNT(*) FROM attendance_duplicate")
+    duplicate_count = cr.fetchone()[0]
+    if not duplicate_count:
+        return
+
+    cr.execute("""
+        UPDATE school_material_movement movement
+           SET attendance_id = duplicate.keeper_id
+          FROM attendance_duplicate duplicate
+         WHERE movement.attendance_id = duplicate.id
+    """)
+    cr.execute("""
+        UPDATE school_attendance_line keeper_line
+           SET attended = TRUE
+          FROM attendance_duplicate duplicate, school_attendance_line line
+         WHERE line.attendance_id = duplicate.id
+           AND line.attended
+           AND keeper_line.attendance_id = duplicate.keeper_id
+           AND keeper_line.student_id = line.student_id
+    """)
+    cr.execute("""
+        UPDATE school_attendance_line line
+           SET attendance_id = duplicate.keeper_id
+          FROM attendance_duplicate duplicate
+         WHERE line.attendance_id = duplicate.id
+           AND NOT EXISTS (SELECT 1 FROM school_attendance_line keeper_line
+                            WHERE keeper_line.attendance_id = duplicate.keeper_id
+                              AND keeper_line.student_id IS NOT DISTINCT FROM line.student_id)
+    """)
+    cr.execute("""
+        DELETE FROM school_attendance_line line
+              USING attendance_duplicate duplicate
+              WHERE line.attendance_id = duplicate.id
+    """)
+    cr.execute("""
+        DELETE FROM school_attendance attendance
+              USING attendance_duplicate duplicate
+              WHERE attendance.id = duplicate.id
+    """)
+    _logger.info(f"Fusionadas {duplicate_count} asistencias duplicadas")
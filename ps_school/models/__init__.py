@@ -16,3 +16,7 @@ from . import school_schedule
 from . import res_users
 from . import school_subject
 from . import school_legal_guardian
+from . import school_material_snapshot
+from . import school_material_forecast
+from . import school_bulk_import
+from . import school_enrollment_history
@@ -65,15 +65,12 @@ class HrEmployee(models.Model):
             record.student_ids = teacher_lines.mapped('student_ids')
 
 
-    @api.depends('subject_line_ids.teacher_ids')
+    @api.depends('subject_line_ids.teacher_ids', 'subject_line_ids.school_id')
     def _compute_school_ids(self):
-        if self.env.context.get('importing_data'):
+        if self.env['school.bulk.import']._defer_if_importing(self, 'school_ids'):
+            self.school_ids = False
             return
 
         for record in self:
-            # Filtrar solo las líneas donde el empleado es profesor y obtener escuelas
-            teacher_lines = self.env['school.course.line'].search([
-                ('teacher_ids', 'in', record.id)
-            ])
-
-            record.school_ids = teacher_lines.mapped('school_id')
\ No newline at end of file
+            # Escuelas de las líneas donde el empleado es profesor, leídas en lote para todos los registros
+            record.school_ids = record.subject_line_ids.school_id
\ No newline at end of file
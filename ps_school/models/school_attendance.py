@@ -2,16 +2,27 @@
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, AccessError
+from psycopg2 import errors
 
 import logging
+import threading
+import time
+from datetime import datetime, timedelta
 
 _logger = logging.getLogger(__name__)
 
+BACKFILL_NEXT_DATE_PARAM = 'ps_school.attendance_backfill_next_date'
+BACKFILL_DATE_TO_PARAM = 'ps_school.attendance_backfill_date_to'
+
 
 class SchoolAttendance(models.Model):
     _name = 'school.attendance'
     _description = 'Attendance tracking'
     _order = 'date desc, id desc'
+    _sql_constraints = [
+        ('date_course_line_uniq', 'unique(date, course_line_id)',
+         'Ya existe una asistencia para este curso en esta fecha.'),
+    ]
 
     name = fields.Char(string='Asistencia', compute='_compute_name', store=True)
     date = fields.Date(string='Fecha', required=True, default=fields.Date.today)
@@ -42,6 +53,11 @@ class SchoolAttendance(models.Model):
         inverse_name='attendance_id',
         string='Movimientos de materiales'
     )
+    material_line_ids = fields.One2many(
+        comodel_name='school.attendance.material.line',
+        inverse_name='attendance_id',
+        string='Materiales'
+    )
 
     materials_status = fields.Selection([
         ('review', 'Borrador'),
@@ -68,38 +84,91 @@ class SchoolAttendance(models.Model):
         }
 
     @api.model_create_multi
-    def create(self, vals):
-        record = super().create(vals)
-        if record.course_line_id:
-            record._generate_attendance_lines()
-        return record
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if not self.env.context.get('skip_attendance_lines'):
+            records._sync_attendance_lines()
+            records._generate_material_lines()
+        return records
 
     def write(self, vals):
         result = super().write(vals)
         if 'course_line_id' in vals:
-            for record in self:
-                # Generate attendance lines after course line change
-                record._generate_attendance_lines()
+            # Sync attendance lines after course line change
+            self._sync_attendance_lines()
         return result
 
-    def _generate_attendance_lines(self):
+    def _sync_attendance_lines(self):
+        """
+        Sync the attendance lines of every record in ``self`` with the students of its course line.
+        Only the differences are written: lines are created for students missing from the attendance
+        and removed for students no longer in the course line, so ``attended`` marks already entered
+        for the remaining students are kept. Lines of students who attended are never removed, as they
+        are real attendance records. Works on the whole recordset with a single unlink and a single create.
+
+        :return: the created school.attendance.line records
+        """
+        lines_to_create = []
+        lines_to_remove = self.env['school.attendance.line']
         for record in self:
-            # Ensure only one record is processed
-            self.ensure_one()
+            roster_ids = set(record.course_line_id.student_ids.ids)
+            current_ids = set()
+            for line in record.attendance_line_ids:
+                if line.student_id and line.student_id.id not in roster_ids and not line.attended:
+                    lines_to_remove |= line
+                current_ids.add(line.student_id.id)
+
+            # Create a new attendance line for each student missing from the attendance
+            lines_to_create += [{
+                'attendance_id': record.id,
+                'student_id': student_id,
+                'attended': False,
+            } for student_id in roster_ids - current_ids]
+
+        lines_to_remove.unlink()
+        return self.env['school.attendance.line'].create(lines_to_create)
+
+    def _generate_material_lines(self):
+        """
+        Snapshot the materials of every box of the course line of each attendance in ``self``.
+        The real quantities are the balances at the end of the attendance date, so backfilled past
+        attendances get the stock of their day. They are read with one grouped balance query per date
+        and the material lines are created with a single create.
 
-            # Clear previous attendance lines
-            record.attendance_line_ids = [(5, 0, 0)]
+        :return: the created school.attendance.material.line records
+        """
+        vals_list = []
+        for date, records in self.grouped('date').items():
+            as_of = datetime.combine(date, datetime.max.time()) if date else None
+            balances = self.env['school.material.movement']._get_balances(
+                records.course_line_id.box_ids.ids, as_of=as_of)
+            vals_list += [{
+                'attendance_id': record.id,
+                'box_id': box_line.box_id.id,
+                'product_id': box_line.product_id.id,
+                'original_expected_quantity': box_line.expected_quantity,
+                'original_real_quantity': balances.get((box_line.box_id.id, box_line.product_id.id), 0),
+            } for record in records for box_line in record.course_line_id.box_ids.box_line_ids if box_line.product_id]
+        return self.env['school.attendance.material.line'].create(vals_list)
+
+    def action_sync_attendance_lines(self):
+        """Re-sync the student lines of the selected open attendances with their course lines"""
+        self.filtered(lambda attendance: attendance.materials_status == 'review')._sync_attendance_lines()
 
-            # Create a new attendance line for each student in the course line
-            if record.course_line_id:
-                lines = [(0, 0, {
-                    'student_id': student.id,
-                    'attended': False
-                }) for student in record.course_line_id.student_ids]
+    @api.model
+    def _sync_open_attendances(self, course_lines=None):
+        """
+        Re-sync the student lines of every open attendance (not closed, from today on), optionally
+        restricted to ``course_lines``. Meant to be called after mid-term enrollment changes.
 
-                record.attendance_line_ids = lines
+        :return: the created school.attendance.line records
+        """
+        domain = [('materials_status', '=', 'review'), ('date', '>=', fields.Date.today())]
+        if course_lines is not None:
+            domain.append(('course_line_id', 'in', course_lines.ids))
+        return self.search(domain)._sync_attendance_lines()
 
-    @api.depends('date', 'course_line_id')
+    @api.depends('date', 'course_line_id.name')
     def _compute_name(self):
         for record in self:
             record.name = f'Asistencia {record.date} - {record.course_line_id.name}'
@@ -123,72 +192,343 @@ class SchoolAttendance(models.Model):
         return action
 
     def action_close_attendance(self):
-        self.ensure_one()
-        self.materials_status = 'closed'
+        """Close the attendances and post their lost and damaged materials as box movements"""
+        attendances = self.filtered(lambda attendance: attendance.materials_status == 'review')
+        attendances._post_material_losses()
+        attendances.materials_status = 'closed'
 
     def action_reopen_attendance(self):
-        self.ensure_one()
         self.materials_status = 'review'
 
     def action_undo_material_movements(self):
-        for record in self:
-            if record.material_movement_ids:
-                record.material_movement_ids.unlink()
+        self.material_movement_ids.unlink()
+
+    def _post_material_losses(self):
+        """
+        Post the lost and damaged quantities of the material lines of every attendance in ``self``
+        as loss movements, in a single create so the balances of the affected boxes are recomputed
+        once. Only the difference with the movements already posted for each material line is
+        posted, so closing an attendance again after a reopen does not post the losses twice.
+
+        :return: the created school.material.movement records
+        """
+        material_lines = self.material_line_ids.filtered('box_id')
+        posted_qty = dict(self.env['school.material.movement']._read_group(
+            [('material_line_id', 'in', material_lines.ids)], ['material_line_id'], ['qty:sum']))
+
+        vals_list = []
+        for line in material_lines:
+            qty = -(line.lost_quantity + line.damaged_quantity) - posted_qty.get(line, 0)
+            if not qty:
+                continue
+            vals_list.append({
+                'box_id': line.box_id.id,
+                'product_id': line.product_id.id,
+                'attendance_id': line.attendance_id.id,
+                'material_line_id': line.id,
+                'qty': qty,
+                'movement_type': 'loss' if qty < 0 else 'increment',
+                'notes': f'Perdidos: {line.lost_quantity}, dañados: {line.damaged_quantity}. {line.notes or ""}'.strip(),
+            })
+        return self.env['school.material.movement'].create(vals_list)
 
     @api.model
-    def create_attendance_with_lines(self):
-        """Create attendance records for today's course lines automatically via cron job"""
+    def create_attendance_with_lines(self, shard=0, shard_count=1):
+        """
+        Create attendance records for today's course lines automatically via cron job.
+
+        The work is split by school, each school being generated and committed on its own so a
+        failing school does not roll back the others. The course lines of a school are claimed
+        with ``SKIP LOCKED`` row locks, so several cron jobs calling this method (optionally each
+        one with a different ``shard`` of the ``shard_count`` course line id hash buckets) can run
+        in parallel without working on the same course lines.
+        """
         try:
             _logger.info("Iniciando creación automática de asistencias...")
 
             today = fields.Date.today()
-            today_weekday = today.weekday()
-
-            weekday_mapping = {
-                0: '0',  # Monday
-                1: '1',
-                2: '2',
-                3: '3',
-                4: '4',
-                5: '5',
-                6: '6'  # Sunday
+            course_lines = self._get_course_lines_for_date(today)
+            if shard_count > 1:
+                course_lines = course_lines.filtered(lambda line: line.id % shard_count == shard)
+
+            auto_commit = not getattr(threading.current_thread(), 'testing', False)
+            stats = {
+                'attendances': 0,
+                'lines': 0,
+                'material_lines': 0,
+                'skipped': 0,
+                'failed_schools': 0,
+                'timings': dict.fromkeys(['course_lines', 'existing', 'attendances', 'lines', 'materials'], 0.0),
             }
+            for school_lines in course_lines.grouped('school_id').values():
+                try:
+                    school_stats = self._run_with_serialization_retry(
+                        lambda: self._generate_attendances_for_dates(
+                            [today], course_lines=self._claim_course_lines(school_lines)),
+                        auto_commit,
+                    )
+                except Exception as e:
+                    _logger.error(f"Error creando asistencias del colegio {school_lines.school_id.id}: {str(e)}")
+                    stats['failed_schools'] += 1
+                    continue
+
+                for key in ('attendances', 'lines', 'material_lines', 'skipped'):
+                    stats[key] += school_stats[key]
+                for step, duration in school_stats['timings'].items():
+                    stats['timings'][step] += duration
+
+                if auto_commit:
+                    # Release the claimed course lines as soon as their school is done
+                    self.env.cr.commit()
+
+            _logger.info(
+                "Proceso completado. Creadas %s asistencias nuevas, %s registros de alumnos y %s de materiales, "
+                "%s colegios con error (búsqueda de cursos %.3fs, existentes %.3fs, asistencias %.3fs, "
+                "alumnos %.3fs, materiales %.3fs)",
+                stats['attendances'], stats['lines'], stats['material_lines'], stats['failed_schools'],
+                stats['timings']['course_lines'], stats['timings']['existing'],
+                stats['timings']['attendances'], stats['timings']['lines'], stats['timings']['materials'],
+            )
+            return stats
+
+        except Exception as e:
+            _logger.error(f"Error en create_attendance_with_lines: {str(e)}")
+            raise
+
+    @api.model
+    def _run_with_serialization_retry(self, generate, auto_commit):
+        """
+        Run ``generate`` inside a savepoint. When it fails because another worker committed
+        conflicting attendances after the transaction snapshot, commit to get a new snapshot that
+        sees them and run it once more.
+        """
+        try:
+            with self.env.cr.savepoint():
+                return generate()
+        except errors.SerializationFailure:
+            if not auto_commit:
+                raise
+            _logger.info("Conflicto de concurrencia al crear asistencias, reintentando en una nueva transacción")
+            self.env.cr.commit()
+            with self.env.cr.savepoint():
+                return generate()
 
-            today_weekday_str = weekday_mapping.get(today_weekday)
-            if not today_weekday_str:
-                _logger.warning(f"No se pudo mapear el día de la semana: {today_weekday}")
-                return
+    @api.model
+    def _claim_course_lines(self, course_lines):
+        """
+        Lock the rows of ``course_lines`` for the current transaction, skipping the ones already
+        locked by another worker, and return the course lines actually claimed
+        """
+        if not course_lines:
+            return course_lines
+        # NO KEY UPDATE still lets other transactions insert attendances referencing these rows
+        self.env.cr.execute("""
+            SELECT id FROM school_course_line
+             WHERE id IN %s
+               FOR NO KEY UPDATE SKIP LOCKED
+        """, [tuple(course_lines.ids)])
+        return course_lines.browse([row[0] for row in self.env.cr.fetchall()])
 
-            # Buscar líneas de curso con horario en el día de hoy
-            course_lines = self.env['school.course.line'].search([
-                ('schedule_ids.weekday', '=', today_weekday_str)
-            ])
+    @api.model
+    def _get_course_lines_for_date(self, date):
+        """Return the course lines active on ``date`` that have a schedule on its weekday"""
+        return self.env['school.course.line'].search(self._get_course_line_domain_for_date(date))
 
-            _logger.info(f"Encontradas {len(course_lines)} líneas de curso para hoy")
+    @api.model
+    def _get_course_line_domain_for_date(self, date):
+        """Domain of the course lines active on ``date`` that have a schedule on its weekday"""
+        weekday_mapping = {
+            0: '0',  # Monday
+            1: '1',
+            2: '2',
+            3: '3',
+            4: '4',
+            5: '5',
+            6: '6'  # Sunday
+        }
 
-            created_count = 0
-            for course_line in course_lines:
-                _logger.info(f"Procesando curso: {course_line.id}")
+        weekday_str = weekday_mapping.get(date.weekday())
+        if not weekday_str:
+            _logger.warning(f"No se pudo mapear el día de la semana: {date.weekday()}")
+            return [('id', '=', False)]
 
-                existing_attendance = self.search([
-                    ('date', '=', today),
-                    ('course_line_id', '=', course_line.id)
-                ])
+        return [
+            ('schedule_ids.weekday', '=', weekday_str),
+            ('start_date', '<=', date),
+            ('end_date', '>=', date),
+        ]
 
-                if existing_attendance:
-                    _logger.info(f"Ya existe asistencia para el curso {course_line.id} en fecha {today}")
-                    continue
+    @api.model
+    def _generate_attendances_for_dates(self, dates, course_lines=None):
+        """
+        Batch creation of the missing attendances (and their student lines) for the given dates,
+        optionally restricted to ``course_lines``.
 
-                attendance = self.create({
-                    'date': today,
-                    'course_line_id': course_line.id,
-                })
+        Existing (date, course_line_id) pairs are fetched with a single query, then every missing
+        attendance is created in one ``create`` call, every attendance line in another one and the
+        material snapshot lines in a last one.
 
-                _logger.info(f"Creada asistencia ID: {attendance.id} con estudiantes y materiales automáticamente")
-                created_count += 1
+        :return: dict with the number of created rows and the time spent on each step
+        """
+        timings = {}
+
+        step_start = time.perf_counter()
+        if course_lines is None:
+            course_lines_by_date = {date: self._get_course_lines_for_date(date) for date in dates}
+        else:
+            course_lines_by_date = {
+                date: course_lines.filtered_domain(self._get_course_line_domain_for_date(date)) for date in dates
+            }
+        all_course_lines = self.env['school.course.line'].union(*course_lines_by_date.values())
+        timings['course_lines'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        existing_pairs = set()
+        if all_course_lines:
+            existing = self.search_fetch([
+                ('date', 'in', list(dates)),
+                ('course_line_id', 'in', all_course_lines.ids),
+            ], ['date', 'course_line_id'])
+            existing_pairs = {(attendance.date, attendance.course_line_id.id) for attendance in existing}
+        timings['existing'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        vals_list = [{
+            'date': date,
+            'course_line_id': course_line.id,
+        } for date, course_lines in course_lines_by_date.items()
+            for course_line in course_lines
+            if (date, course_line.id) not in existing_pairs]
+        attendances = self._create_missing_attendances(vals_list)
+        timings['attendances'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        lines = attendances._sync_attendance_lines()
+        timings['lines'] = time.perf_counter() - step_start
+
+        step_start = time.perf_counter()
+        material_lines = attendances._generate_material_lines()
+        timings['materials'] = time.perf_counter() - step_start
 
-            _logger.info(f"Proceso completado. Creadas {created_count} asistencias nuevas")
+        return {
+            'attendances': len(attendances),
+            'lines': len(lines),
+            'material_lines': len(material_lines),
+            'skipped': len(existing_pairs),
+            'timings': timings,
+        }
 
-        except Exception as e:
-            _logger.error(f"Error en create_attendance_with_lines: {str(e)}")
-            raise
+    @api.model
+    def _create_missing_attendances(self, vals_list):
+        """
+        Create the attendances of ``vals_list`` without their lines, tolerating the ones created
+        meanwhile by another worker. The whole batch is inserted with a single
+        ``ON CONFLICT (date, course_line_id) DO NOTHING`` query, so the pairs already taken are
+        skipped by the database itself, then the stored computed fields of the inserted rows are
+        computed through the ORM.
+
+        At REPEATABLE READ, a conflicting row committed after the transaction snapshot raises a
+        serialization failure instead; callers retry in a new transaction.
+
+        :return: the created school.attendance records
+        """
+        if not vals_list:
+            return self.browse()
+        self.flush_model()
+        self.env.cr.execute("""
+            INSERT INTO school_attendance
+                        (date, course_line_id, materials_status, create_uid, create_date, write_uid, write_date)
+                 SELECT attendance.date, attendance.course_line_id, 'review',
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                   FROM unnest(%(dates)s::date[], %(course_line_ids)s::int[]) AS attendance(date, course_line_id)
+            ON CONFLICT (date, course_line_id) DO NOTHING
+              RETURNING id
+        """, {
+            'uid': self.env.uid,
+            'dates': [vals['date'] for vals in vals_list],
+            'course_line_ids': [vals['course_line_id'] for vals in vals_list],
+        })
+        attendances = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if len(attendances) < len(vals_list):
+            _logger.info(f"{len(vals_list) - len(attendances)} asistencias creadas en paralelo, se omiten")
+        for field in self._fields.values():
+            if field.store and field.compute:
+                self.env.add_to_compute(field, attendances)
+        attendances.flush_recordset()
+        return attendances
+
+    @api.model
+    def cleanup_out_of_window_attendances(self):
+        """
+        Remove the attendances dated outside the start/end window of their course line that are
+        still empty: not closed, without any student marked as attended and without material
+        movements. The candidates are found with a single query and removed in bulk.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT attendance.id
+              FROM school_attendance attendance
+              JOIN school_course_line course_line ON course_line.id = attendance.course_line_id
+             WHERE (attendance.date < course_line.start_date OR attendance.date > course_line.end_date)
+               AND attendance.materials_status = 'review'
+               AND NOT EXISTS (SELECT 1 FROM school_attendance_line line
+                                WHERE line.attendance_id = attendance.id AND line.attended)
+               AND NOT EXISTS (SELECT 1 FROM school_material_movement movement
+                                WHERE movement.attendance_id = attendance.id)
+        """)
+        attendances = self.browse([row[0] for row in self.env.cr.fetchall()])
+
+        # Lines are not deleted in cascade with their attendance
+        attendances.attendance_line_ids.unlink()
+        attendances.unlink()
+
+        _logger.info(f"Eliminadas {len(attendances)} asistencias vacías fuera del periodo de su curso")
+        return len(attendances)
+
+    @api.model
+    def _start_attendance_backfill(self, date_from, date_to):
+        """Save a new backfill range as checkpoint, replacing any unfinished one"""
+        ConfigParameter = self.env['ir.config_parameter'].sudo()
+        ConfigParameter.set_param(BACKFILL_NEXT_DATE_PARAM, fields.Date.to_string(date_from))
+        ConfigParameter.set_param(BACKFILL_DATE_TO_PARAM, fields.Date.to_string(date_to))
+
+    @api.model
+    def backfill_attendances(self, date_from=None, date_to=None, chunk_days=7):
+        """
+        Create the missing attendances of every day between ``date_from`` and ``date_to`` (both
+        included), walking the range in chunks of ``chunk_days`` days and committing after each one.
+
+        The next date to process is saved as checkpoint after every chunk, so when called without
+        a range the job resumes the last unfinished backfill. Existing attendances are skipped, so
+        running it twice over the same days is harmless.
+        """
+        ConfigParameter = self.env['ir.config_parameter'].sudo()
+        if date_from and date_to:
+            self._start_attendance_backfill(fields.Date.to_date(date_from), fields.Date.to_date(date_to))
+
+        next_date = fields.Date.to_date(ConfigParameter.get_param(BACKFILL_NEXT_DATE_PARAM))
+        date_to = fields.Date.to_date(ConfigParameter.get_param(BACKFILL_DATE_TO_PARAM))
+        if not next_date or not date_to:
+            return
+
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        _logger.info(f"Reanudando relleno de asistencias desde {next_date} hasta {date_to}")
+
+        while next_date <= date_to:
+            chunk_end = min(next_date + timedelta(days=chunk_days - 1), date_to)
+            dates = [next_date + timedelta(days=offset) for offset in range((chunk_end - next_date).days + 1)]
+
+            stats = self._run_with_serialization_retry(
+                lambda: self._generate_attendances_for_dates(dates), auto_commit)
+            _logger.info(f"Relleno de asistencias {next_date} - {chunk_end}: creadas {stats['attendances']} "
+                         f"asistencias y {stats['lines']} registros de alumnos")
+
+            next_date = chunk_end + timedelta(days=1)
+            ConfigParameter.set_param(BACKFILL_NEXT_DATE_PARAM, fields.Date.to_string(next_date))
+            if auto_commit:
+                self.env.cr.commit()
+
+        # Backfill finished, clear the checkpoint
+        ConfigParameter.set_param(BACKFILL_NEXT_DATE_PARAM, False)
+        ConfigParameter.set_param(BACKFILL_DATE_TO_PARAM, False)
+        _logger.info("Relleno de asistencias completado")
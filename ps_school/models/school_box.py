@@ -43,27 +43,36 @@ class SchoolBox(models.Model):
 
     @api.depends('material_movement_ids')
     def _compute_total_material_movement(self):
+        counts = dict(self.env['school.material.movement']._read_group(
+            [('box_id', 'in', self._origin.ids)], ['box_id'], ['__count']))
         for record in self:
-            record.total_material_movement = len(record.material_movement_ids)
+            record.total_material_movement = counts.get(record._origin, 0)
 
     def action_initial_replenisment_all(self):
         unreplenished_boxes = self.env['school.box'].search([('material_movement_ids', '=', False)])
-        for box in unreplenished_boxes:
-            box.action_initial_replenishment()
+        unreplenished_boxes.action_initial_replenishment()
 
     def action_initial_replenishment(self):
-        if not self.material_movement_ids:
-            return self.env['school.material.movement'].create([{
-                'box_id': self.id,
-                'notes': 'Reabastecimiento inicial de materiales.',
-                'movement_type': 'increment',
-                'product_id': line.product_id.id,
-                'qty': line.expected_quantity
-            } for line in self.box_line_ids])
-
-    @api.depends('box_line_ids.real_quantity', 'box_line_ids.expected_quantity')
+        """
+        Create the initial movements of every box in ``self`` without movements, all of them in a
+        single create so the dependent box fields are recomputed once for the whole batch
+        """
+        replenished_boxes = self.env['school.material.movement']._read_group(
+            [('box_id', 'in', self.ids)], ['box_id'])
+        boxes = self - self.browse([box.id for [box] in replenished_boxes])
+        return self.env['school.material.movement'].create([{
+            'box_id': box.id,
+            'notes': 'Reabastecimiento inicial de materiales.',
+            'movement_type': 'increment',
+            'product_id': line.product_id.id,
+            'qty': line.expected_quantity
+        } for box in boxes for line in box.box_line_ids])
+
+    @api.depends('box_line_ids.product_id', 'box_line_ids.expected_quantity')
     def _compute_alert_icon(self):
-        """ Calculate if there are any differences in materials """
+        """ Calculate if there are any differences in materials.
+        Balance changes do not trigger this compute through the ORM dependencies, the movements
+        call _recompute_alert_icon on the boxes they affect."""
         for record in self:
             has_difference = any(
                 line.real_quantity < line.expected_quantity
@@ -72,6 +81,41 @@ class SchoolBox(models.Model):
             record.differences = has_difference
             record.alert_icon = '<span class="text-warning">Diferencia de cantidades⚠️</span>' if has_difference else ''
 
+    def _recompute_alert_icon(self):
+        """
+        Mark the alert flags of the boxes for recompute. With ``defer_box_alerts`` in the context
+        the boxes are queued instead, and the flags of every queued box are recomputed once, in
+        batch, right before the transaction is committed.
+        """
+        if self.env.context.get('defer_box_alerts'):
+            pending_box_ids = self.env.cr.precommit.data.setdefault('ps_school.deferred_box_alert_ids', set())
+            if not pending_box_ids:
+                self.env.cr.precommit.add(self._flush_deferred_alert_icon)
+            pending_box_ids.update(self.ids)
+            return
+        self.env.add_to_compute(self._fields['alert_icon'], self)
+        self.env.add_to_compute(self._fields['differences'], self)
+
+    def _flush_deferred_alert_icon(self):
+        """Recompute the alert flags of the boxes queued in deferred mode"""
+        box_ids = self.env.cr.precommit.data.pop('ps_school.deferred_box_alert_ids', set())
+        boxes = self.env['school.box'].browse(box_ids).exists().with_context(defer_box_alerts=False)
+        boxes._recompute_alert_icon()
+        boxes.flush_recordset(['alert_icon', 'differences'])
+
+    def get_stock_as_of(self, date):
+        """
+        Material balance of the boxes in ``self`` as of ``date``, read from the latest snapshot
+        before that date plus the movements after it.
+
+        :return: dict mapping box ids to a dict of product ids and quantities
+        """
+        stock = {box_id: {} for box_id in self.ids}
+        balances = self.env['school.material.movement']._get_balances(self.ids, as_of=date)
+        for (box_id, product_id), qty in balances.items():
+            stock[box_id][product_id] = qty
+        return stock
+
     @api.depends('box_line_ids')
     def _compute_products_ids(self):
         for record in self:
@@ -134,11 +178,30 @@ class SchoolBoxLine(models.Model):
         store=True
     )
 
-    @api.depends('box_material_movement_ids')
+    @api.depends('box_id', 'product_id')
     def _compute_real_quantity(self):
+        """
+        Balance of the line product inside its box, computed with a single grouped sum over the
+        movements of every (box, product) pair in ``self``. Movements do not trigger this compute
+        through the ORM dependencies, they call _recompute_real_quantity with the pairs they affect.
+        """
+        balances = self.env['school.material.movement']._get_balances(
+            self.box_id._origin.ids, self.product_id._origin.ids)
         for record in self:
-            movements = record.box_material_movement_ids.filtered(lambda x: x.product_id == record.product_id)
-            record.real_quantity = sum(movements.mapped('qty'))
+            record.real_quantity = balances.get((record.box_id._origin.id, record.product_id._origin.id), 0)
+
+    @api.model
+    def _recompute_real_quantity(self, pairs):
+        """Mark for recompute the real quantity of the lines matching the given (box_id, product_id) pairs"""
+        if not pairs:
+            return
+        lines = self.search([
+            ('box_id', 'in', list({box_id for box_id, _product_id in pairs})),
+            ('product_id', 'in', list({product_id for _box_id, product_id in pairs})),
+        ]).filtered(lambda line: (line.box_id.id, line.product_id.id) in pairs)
+        self.env.add_to_compute(self._fields['real_quantity'], lines)
+        lines.modified(['real_quantity'])
+        lines.box_id._recompute_alert_icon()
 
     @api.depends('expected_quantity', 'real_quantity')
     def _compute_quantity_difference(self):
@@ -158,6 +221,7 @@ class AttendanceMaterialLine(models.Model):
         ondelete='cascade'
     )
 
+    box_id = fields.Many2one(comodel_name='school.box', string='Caja')
     product_id = fields.Many2one(
         comodel_name='product.product',
         string='Producto',
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+import logging
+
+_logger = logging.getLogger(__name__)
+
+DEFERRED_IMPORT_KEY = 'ps_school.bulk_import'
+
+
+class SchoolBulkImport(models.AbstractModel):
+    """ Bulk-load mode, enabled with ``importing_data`` in the context.
+
+    In this mode the expensive computes and post-processing steps of the school models are not run
+    record by record: the records are queued and, right before the transaction is committed, the
+    queued fields are recomputed and the queued methods called once, in batch, for exactly the
+    touched records."""
+    _name = 'school.bulk.import'
+    _description = 'School bulk import mode'
+
+    @api.model
+    def _defer_if_importing(self, records, step):
+        """
+        Queue ``records`` for the deferred ``step`` (the name of a stored computed field or of a
+        method of the model) when the bulk import mode is enabled.
+
+        :return: True if the step has been deferred and must be skipped by the caller
+        """
+        if not self.env.context.get('importing_data'):
+            return False
+        deferred = self.env.cr.precommit.data.setdefault(DEFERRED_IMPORT_KEY, {})
+        if not deferred:
+            self.env.cr.precommit.add(self.flush_bulk_import)
+        deferred.setdefault((records._name, step), set()).update(records._origin.ids)
+        return True
+
+    @api.model
+    def flush_bulk_import(self):
+        """Run the deferred steps of the bulk import mode for the queued records"""
+        deferred = self.env.cr.precommit.data.pop(DEFERRED_IMPORT_KEY, {})
+        if not deferred:
+            return
+        env = self.with_context(importing_data=False).env
+        for (model_name, step), ids in deferred.items():
+            records = env[model_name].browse(ids).exists()
+            if step in records._fields:
+                env.add_to_compute(records._fields[step], records)
+                records.modified([step])
+            else:
+                getattr(records, step)()
+            _logger.info(f"Importación masiva: {step} de {len(records)} registros de {model_name}")
+        env.flush_all()
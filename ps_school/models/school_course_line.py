@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from collections import defaultdict
 from random import randint
 
 from odoo import api, fields, models, _
@@ -13,8 +14,7 @@ class SchoolCourseLine(models.Model):
     _description = 'Course Line'
     _rec_name = 'name'
 
-    name = fields.Char(string='Línea de Curso', compute='_compute_name', store=False)
-    display_name = fields.Char(string='Display Name', compute='_compute_display_name', store=False)
+    name = fields.Char(string='Línea de Curso', compute='_compute_name', store=True, index='trigram')
     program_id = fields.Many2one(comodel_name='school.program', string='Programa')
     school_id = fields.Many2one(
         comodel_name='res.partner',
@@ -62,8 +62,8 @@ class SchoolCourseLine(models.Model):
         inverse_name='course_line_id',
         string='Asistencias'
     )
-    start_date = fields.Date(string='Start', required=True)
-    end_date = fields.Date(string='End', required=True)
+    start_date = fields.Date(string='Start', required=True, index=True)
+    end_date = fields.Date(string='End', required=True, index=True)
     academic_period = fields.Char(string="Periodo académico")
     box_ids = fields.Many2many(comodel_name='school.box', string='Caja de materiales', help="Caja de materiales")
 
@@ -72,12 +72,50 @@ class SchoolCourseLine(models.Model):
         for record in self:
             record.related_program_ids = record.course_id.program_ids
 
-    @api.depends('student_ids')
+    @api.depends('student_ids', 'student_ids.enrollment_state')
     def _compute_student_qty(self):
+        if self.env['school.bulk.import']._defer_if_importing(self, 'student_qty'):
+            self.student_qty = self.active_student_qty = self.inactive_student_qty = 0
+            return
+        counts = self._get_student_counts('course_line.id', self.filtered('id').ids)
         for record in self:
-            record.student_qty = len(record.student_ids)
-            record.active_student_qty = len(record.student_ids.filtered(lambda s: s.enrollment_state == 'active'))
-            record.inactive_student_qty = len(record.student_ids.filtered(lambda s: s.enrollment_state == 'inactive'))
+            if record.id:
+                record.student_qty, record.active_student_qty, record.inactive_student_qty = counts[record.id]
+            else:
+                # Unsaved course line being edited in a form, count the students in memory
+                record.student_qty = len(record.student_ids)
+                record.active_student_qty = len(record.student_ids.filtered(lambda s: s.enrollment_state == 'active'))
+                record.inactive_student_qty = len(record.student_ids.filtered(lambda s: s.enrollment_state == 'inactive'))
+
+    @api.model
+    def _get_student_counts(self, group_column, ids):
+        """
+        Count the distinct students of the course lines grouped by ``group_column`` (a column of
+        the course line table) with a single grouped query over course_line_student_rel joined to
+        the enrollment state of the students.
+
+        :return: dict mapping each id of ``ids`` to a (total, active, inactive) tuple
+        """
+        counts = {record_id: [0, 0, 0] for record_id in ids}
+        if not ids:
+            return {record_id: tuple(count) for record_id, count in counts.items()}
+        self.flush_model(['student_ids', 'school_id'])
+        self.env['res.partner'].flush_model(['enrollment_state'])
+        self.env.cr.execute(f"""
+            SELECT {group_column}, partner.enrollment_state, COUNT(DISTINCT rel.student_id)
+              FROM course_line_student_rel rel
+              JOIN school_course_line course_line ON course_line.id = rel.course_line_id
+              JOIN res_partner partner ON partner.id = rel.student_id
+             WHERE {group_column} = ANY(%s)
+          GROUP BY {group_column}, partner.enrollment_state
+        """, [list(ids)])
+        for record_id, state, count in self.env.cr.fetchall():
+            counts[record_id][0] += count
+            if state == 'active':
+                counts[record_id][1] += count
+            elif state == 'inactive':
+                counts[record_id][2] += count
+        return {record_id: tuple(count) for record_id, count in counts.items()}
 
     @api.constrains('start_date', 'end_date')
     def _check_dates(self):
@@ -90,30 +128,146 @@ class SchoolCourseLine(models.Model):
     def create(self, vals_list):
         """Override create to auto-assign school to students when creating course lines"""
         records = super().create(vals_list)
-        for record in records:
-            record._auto_assign_school_to_students()
+        records._auto_assign_school_to_students()
+        self.env['school.enrollment.history'].sudo()._open_periods(
+            [(record.id, student.id) for record in records for student in record.student_ids], from_today=False)
         return records
 
     def write(self, vals):
         """Override write to auto-assign school to students when updating course lines"""
+        rosters = {record.id: set(record.student_ids.ids) for record in self} if 'student_ids' in vals else {}
         result = super().write(vals)
         # Si se modificaron los estudiantes o la escuela, actualizar asignación
         if 'student_ids' in vals or 'school_id' in vals:
+            self._auto_assign_school_to_students()
+        history = self.env['school.enrollment.history'].sudo()
+        if rosters:
+            added, removed = [], []
             for record in self:
-                record._auto_assign_school_to_students()
+                student_ids = set(record.student_ids.ids)
+                added += [(record.id, student_id) for student_id in student_ids - rosters[record.id]]
+                removed += [(record.id, student_id) for student_id in rosters[record.id] - student_ids]
+            history._close_periods(removed)
+            history._open_periods(added)
+        if 'school_id' in vals:
+            history._move_periods_to_school(self.ids)
+        if 'start_date' in vals or 'end_date' in vals:
+            history._refresh_periods(course_line_ids=self.ids)
         return result
 
     def _auto_assign_school_to_students(self):
         """
         Método para asignar automáticamente la escuela a los estudiantes
-        cuando se modifica la línea de curso
+        cuando se modifica la línea de curso.
+        Los estudiantes sin escuela de todas las líneas se agrupan por escuela, con una sola
+        escritura por escuela. Un estudiante en varias líneas recibe la escuela de la primera.
         """
-        if self.env.context.get('importing_data'):
+        if self.env['school.bulk.import']._defer_if_importing(self, '_auto_assign_school_to_students'):
             return
-        if self.school_id and self.student_ids:
-            students_to_update = self.student_ids.filtered(lambda s: not s.school_id)
-            if students_to_update:
-                students_to_update.write({'school_id': self.school_id.id})
+        student_ids_by_school = defaultdict(set)
+        assigned_ids = set()
+        for record in self.filtered('school_id'):
+            student_ids = set(record.student_ids.filtered(lambda s: not s.school_id).ids) - assigned_ids
+            student_ids_by_school[record.school_id.id] |= student_ids
+            assigned_ids |= student_ids
+
+        for school_id, student_ids in student_ids_by_school.items():
+            if student_ids:
+                self.env['res.partner'].browse(student_ids).write({'school_id': school_id})
+
+    @api.model
+    def apply_enrollment(self, mapping):
+        """
+        Move students between course lines in a single pass, without firing the per-record
+        compute chain of the roster many2many.
+
+        Each student of ``mapping`` is added to its target course line and removed from every other
+        course line of the same program whose period overlaps the target one. The user needs write
+        access on the target and the source course lines. The roster table is updated with set
+        operations, then the school of the moved students, the student counters, the open
+        attendances and the other rosters of the touched course lines are fixed in batch.
+
+        :param mapping: dict mapping student ids to their target course line id
+        :return: dict summarizing the changes
+        """
+        moves = {int(student_id): int(course_line_id) for student_id, course_line_id in mapping.items()}
+        targets = self.browse(set(moves.values())).exists()
+        if len(targets) != len(set(moves.values())):
+            raise UserError('Algunas de las líneas de curso de destino no existen.')
+        if not moves:
+            return {'added': 0, 'removed': 0, 'course_lines': 0, 'students': 0, 'attendance_lines': 0}
+        targets.check_access('write')
+
+        self.flush_model(['student_ids', 'program_id', 'start_date', 'end_date'])
+        params = [list(moves), list(moves.values())]
+        self.env.cr.execute("""
+            DELETE FROM course_line_student_rel rel
+                  USING school_course_line current_line,
+                        school_course_line target_line,
+                        unnest(%s::int[], %s::int[]) AS move(student_id, course_line_id)
+                  WHERE rel.student_id = move.student_id
+                    AND target_line.id = move.course_line_id
+                    AND current_line.id = rel.course_line_id
+                    AND current_line.id != target_line.id
+                    AND current_line.program_id IS NOT DISTINCT FROM target_line.program_id
+                    AND current_line.start_date <= target_line.end_date
+                    AND current_line.end_date >= target_line.start_date
+              RETURNING rel.course_line_id, rel.student_id
+        """, params)
+        removed = self.env.cr.fetchall()
+        # Raising rolls back the deletion above
+        self.browse({course_line_id for course_line_id, _student_id in removed}).check_access('write')
+        self.env.cr.execute("""
+            INSERT INTO course_line_student_rel (student_id, course_line_id)
+                 SELECT move.student_id, move.course_line_id
+                   FROM unnest(%s::int[], %s::int[]) AS move(student_id, course_line_id)
+            ON CONFLICT DO NOTHING
+              RETURNING course_line_id, student_id
+        """, params)
+        added = self.env.cr.fetchall()
+
+        self.invalidate_model(['student_ids'])
+        self.env['res.partner'].invalidate_model(['student_course_line_ids'])
+
+        touched_lines = self.browse({course_line_id for course_line_id, _student_id in removed + added})
+        touched_lines._after_enrollment_change(added, removed)
+
+        # Moved students belong to the school of their target course line, one write per school
+        student_ids_by_school = defaultdict(set)
+        for student in self.env['res.partner'].browse(moves):
+            school = self.browse(moves[student.id]).school_id
+            if school and student.school_id != school:
+                student_ids_by_school[school.id].add(student.id)
+        for school_id, student_ids in student_ids_by_school.items():
+            self.env['res.partner'].browse(student_ids).write({'school_id': school_id})
+
+        attendance_lines = self.env['school.attendance']._sync_open_attendances(touched_lines)
+
+        summary = {
+            'added': len(added),
+            'removed': len(removed),
+            'course_lines': len(touched_lines),
+            'students': len(moves),
+            'attendance_lines': len(attendance_lines),
+        }
+        _logger.info(f"Matriculación masiva aplicada: {summary}")
+        return summary
+
+    def _after_enrollment_change(self, added, removed):
+        """
+        Hook called on the course lines whose roster has been changed by apply_enrollment, to
+        update in batch the data depending on the rosters
+
+        :param added: list of (course_line_id, student_id) pairs added to the rosters
+        :param removed: list of (course_line_id, student_id) pairs removed from the rosters
+        """
+        history = self.env['school.enrollment.history'].sudo()
+        history._close_periods(removed)
+        history._open_periods(added)
+        schools = self.school_id
+        for fname in ('student_qty', 'active_student_qty', 'inactive_student_qty'):
+            self.env.add_to_compute(self._fields[fname], self)
+            self.env.add_to_compute(schools._fields[fname], schools)
 
     # Mantener el onchange para la interfaz
     @api.onchange("student_ids")
@@ -142,78 +296,22 @@ class SchoolCourseLine(models.Model):
     def _get_name_parts(self):
         """Método auxiliar para obtener las partes del nombre"""
         name_parts = []
-        # Verificar school_id
-        if self.school_id:
-            try:
-                if self.school_id.name:
-                    name_parts.append(f"Escuela: {self.school_id.name}")
-            except:
-                name_parts.append("Escuela")
-
-        # Verificar course_id
-        if self.course_id:
-            try:
-                if self.course_id.name:
-                    name_parts.append(f"Grupo: {self.course_id.name}")
-            except:
-                name_parts.append("Curso")
-
-        # Verificar program_id
-        if self.program_id:
-            try:
-                if self.program_id.name:
-                    name_parts.append(f"Programa: {self.program_id.name}")
-            except:
-                name_parts.append("Programa")
-
+        if self.school_id.name:
+            name_parts.append(f"Escuela: {self.school_id.name}")
+        if self.course_id.name:
+            name_parts.append(f"Grupo: {self.course_id.name}")
+        if self.program_id.name:
+            name_parts.append(f"Programa: {self.program_id.name}")
         return name_parts
 
-    @api.depends('course_id', 'program_id', 'school_id')
+    @api.depends('course_id.name', 'program_id.name', 'school_id.name')
     def _compute_name(self):
+        if self.env['school.bulk.import']._defer_if_importing(self, 'name'):
+            self.name = False
+            return
         for record in self:
-            if record.env.context.get('importing_data'):
-                continue
-            try:
-                name_parts = record._get_name_parts()
-                if name_parts:
-                    record.name = ' - '.join(name_parts)
-                else:
-                    record.name = f'Línea #{record.id}' if record.id else 'Nueva Línea'
-            except Exception as e:
-                _logger.error(f"Error computing name for course line {record.id}: {str(e)}")
-                record.name = f'Error #{record.id}' if record.id else 'Error'
-
-    @api.depends('course_id', 'program_id', 'school_id')
-    def _compute_display_name(self):
-        for record in self:
-            if record.env.context.get('importing_data'):
-                continue
-            try:
-                name_parts = record._get_name_parts()
-                if name_parts:
-                    record.display_name = ' - '.join(name_parts)
-                else:
-                    record.display_name = f'Línea #{record.id}' if record.id else 'Nueva Línea'
-            except Exception as e:
-                import logging
-                _logger = logging.getLogger(__name__)
-                _logger.error(f"Error computing display_name for course line {record.id}: {str(e)}")
-                record.display_name = f'Error #{record.id}' if record.id else 'Error'
-
-    def name_get(self):
-        """Override name_get como respaldo"""
-        result = []
-        for record in self:
-            try:
-                name_parts = record._get_name_parts()
-                if name_parts:
-                    name = ' - '.join(name_parts)
-                else:
-                    name = f'Línea #{record.id}' if record.id else 'Nueva Línea'
-                result.append((record.id, name))
-            except Exception as e:
-                import logging
-                _logger = logging.getLogger(__name__)
-                _logger.error(f"Error in name_get for course line {record.id}: {str(e)}")
-                result.append((record.id, f'Error #{record.id}' if record.id else 'Error'))
-        return result
+            name_parts = record._get_name_parts()
+            if name_parts:
+                record.name = ' - '.join(name_parts)
+            else:
+                record.name = f'Línea #{record.id}' if record.id else 'Nueva Línea'
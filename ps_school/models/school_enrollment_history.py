@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models, tools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class SchoolEnrollmentHistory(models.Model):
+    """ Effective-dated membership of a student in a course line, so headcounts at any past date
+    are read with a single range query instead of being rebuilt from the current rosters."""
+    _name = 'school.enrollment.history'
+    _description = 'Enrollment history'
+    _order = 'date_from desc, id desc'
+
+    student_id = fields.Many2one(comodel_name='res.partner', string='Estudiante', required=True,
+                                 ondelete='cascade', index=True)
+    course_line_id = fields.Many2one(comodel_name='school.course.line', string='Línea de curso', required=True,
+                                     ondelete='cascade')
+    # School of the course line during the period, a course line changing school splits its open periods
+    school_id = fields.Many2one(comodel_name='res.partner', string='Colegio', readonly=True)
+    date_from = fields.Date(string='Desde', required=True)
+    # Last day of membership, both bounds are included
+    date_to = fields.Date(string='Hasta', required=True)
+
+    def init(self):
+        tools.create_index(self.env.cr, 'school_enrollment_history_course_line_dates_idx',
+                           self._table, ['course_line_id', 'date_from', 'date_to'])
+        tools.create_index(self.env.cr, 'school_enrollment_history_school_dates_idx',
+                           self._table, ['school_id', 'date_from', 'date_to'])
+
+    @api.model
+    def _get_enrolled_counts(self, date, group_field='course_line_id', ids=None):
+        """
+        Number of students enrolled at a given date, with a single query over the date indexes.
+
+        :param date: date of the headcount
+        :param group_field: 'course_line_id' or 'school_id'
+        :param ids: optional ids of the course lines or schools to count
+        :return: dict mapping course line or school ids to their number of students
+        """
+        domain = [('date_from', '<=', date), ('date_to', '>=', date)]
+        if ids is not None:
+            domain.append((group_field, 'in', list(ids)))
+        return {
+            group.id: count
+            for group, count in self._read_group(domain, [group_field], ['student_id:count_distinct'])
+        }
+
+    def _flush_enrollment_sources(self):
+        self.env['school.course.line'].flush_model(['student_ids', 'school_id', 'start_date', 'end_date'])
+        self.env['res.partner'].flush_model(['start_date', 'finish_date'])
+        self.flush_model()
+
+    @api.model
+    def _open_periods(self, pairs, from_today=True):
+        """
+        Start the membership of the given students in their course lines. The period runs from the
+        later of the course line start, the student start and, for live changes, today, until the
+        earlier of the course line end and the student finish date.
+
+        :param pairs: list of (course_line_id, student_id) pairs added to the rosters
+        :param from_today: whether the membership cannot start before today
+        """
+        if not pairs:
+            return
+        self._flush_enrollment_sources()
+        self.env.cr.execute("""
+            INSERT INTO school_enrollment_history
+                        (student_id, course_line_id, school_id, date_from, date_to,
+                         create_uid, create_date, write_uid, write_date)
+                 SELECT partner.id, line.id, line.school_id,
+                        GREATEST(line.start_date, partner.start_date, %(today)s::date),
+                        LEAST(line.end_date, partner.finish_date),
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                   FROM unnest(%(course_line_ids)s::int[], %(student_ids)s::int[]) AS pair(course_line_id, student_id)
+                   JOIN school_course_line line ON line.id = pair.course_line_id
+                   JOIN res_partner partner ON partner.id = pair.student_id
+        """, {
+            'today': fields.Date.context_today(self) if from_today else None,
+            'uid': self.env.uid,
+            'course_line_ids': [course_line_id for course_line_id, _student_id in pairs],
+            'student_ids': [student_id for _course_line_id, student_id in pairs],
+        })
+        self.invalidate_model()
+
+    @api.model
+    def _close_periods(self, pairs):
+        """
+        End today the membership of the given students in their course lines. Periods that had not
+        started yet are removed.
+
+        :param pairs: list of (course_line_id, student_id) pairs removed from the rosters
+        """
+        if not pairs:
+            return
+        self._flush_enrollment_sources()
+        params = {
+            'today': fields.Date.context_today(self),
+            'course_line_ids': [course_line_id for course_line_id, _student_id in pairs],
+            'student_ids': [student_id for _course_line_id, student_id in pairs],
+        }
+        self.env.cr.execute("""
+            DELETE FROM school_enrollment_history history
+                  USING unnest(%(course_line_ids)s::int[], %(student_ids)s::int[]) AS pair(course_line_id, student_id)
+                  WHERE history.course_line_id = pair.course_line_id
+                    AND history.student_id = pair.student_id
+                    AND history.date_from > %(today)s
+        """, params)
+        self.env.cr.execute("""
+            UPDATE school_enrollment_history history
+               SET date_to = %(today)s, write_date = now() at time zone 'UTC'
+              FROM unnest(%(course_line_ids)s::int[], %(student_ids)s::int[]) AS pair(course_line_id, student_id)
+             WHERE history.course_line_id = pair.course_line_id
+               AND history.student_id = pair.student_id
+               AND history.date_to > %(today)s
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def _refresh_periods(self, course_line_ids=None, student_ids=None):
+        """
+        Align the current period of the students still in the rosters with the dates of their
+        course lines and their start/finish dates. Closed periods are kept as they are. The start
+        only moves forward, so students who joined mid-term keep their join date.
+
+        :param course_line_ids: ids of the course lines whose dates changed
+        :param student_ids: ids of the students whose dates changed
+        """
+        if not course_line_ids and not student_ids:
+            return
+        self._flush_enrollment_sources()
+        self.env.cr.execute("""
+            UPDATE school_enrollment_history history
+               SET date_from = GREATEST(history.date_from, line.start_date, partner.start_date),
+                   date_to = LEAST(line.end_date, partner.finish_date),
+                   write_date = now() at time zone 'UTC'
+              FROM course_line_student_rel rel
+              JOIN school_course_line line ON line.id = rel.course_line_id
+              JOIN res_partner partner ON partner.id = rel.student_id
+             WHERE history.course_line_id = rel.course_line_id
+               AND history.student_id = rel.student_id
+               AND (rel.course_line_id = ANY(%(course_line_ids)s) OR rel.student_id = ANY(%(student_ids)s))
+               AND history.id = (
+                    SELECT latest.id FROM school_enrollment_history latest
+                     WHERE latest.course_line_id = rel.course_line_id
+                       AND latest.student_id = rel.student_id
+                  ORDER BY latest.date_from DESC, latest.id DESC
+                     LIMIT 1)
+        """, {
+            'course_line_ids': list(course_line_ids or []),
+            'student_ids': list(student_ids or []),
+        })
+        self.invalidate_model()
+
+    @api.model
+    def _move_periods_to_school(self, course_line_ids):
+        """
+        Move the open periods of the given course lines to their current school. Periods already
+        started are closed yesterday and continued from today under the new school, so the
+        headcounts of the past days stay with the previous school.
+
+        :param course_line_ids: ids of the course lines whose school changed
+        """
+        if not course_line_ids:
+            return
+        self._flush_enrollment_sources()
+        params = {
+            'today': fields.Date.context_today(self),
+            'uid': self.env.uid,
+            'course_line_ids': list(course_line_ids),
+        }
+        self.env.cr.execute("""
+            INSERT INTO school_enrollment_history
+                        (student_id, course_line_id, school_id, date_from, date_to,
+                         create_uid, create_date, write_uid, write_date)
+                 SELECT history.student_id, history.course_line_id, line.school_id, %(today)s, history.date_to,
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                   FROM school_enrollment_history history
+                   JOIN school_course_line line ON line.id = history.course_line_id
+                  WHERE line.id = ANY(%(course_line_ids)s)
+                    AND history.date_from < %(today)s
+                    AND history.date_to >= %(today)s
+                    AND history.school_id IS DISTINCT FROM line.school_id
+        """, params)
+        self.env.cr.execute("""
+            UPDATE school_enrollment_history history
+               SET date_to = %(today)s::date - 1, write_date = now() at time zone 'UTC'
+              FROM school_course_line line
+             WHERE line.id = history.course_line_id
+               AND line.id = ANY(%(course_line_ids)s)
+               AND history.date_from < %(today)s
+               AND history.date_to >= %(today)s
+               AND history.school_id IS DISTINCT FROM line.school_id
+        """, params)
+        self.env.cr.execute("""
+            UPDATE school_enrollment_history history
+               SET school_id = line.school_id, write_date = now() at time zone 'UTC'
+              FROM school_course_line line
+             WHERE line.id = history.course_line_id
+               AND line.id = ANY(%(course_line_ids)s)
+               AND history.date_from >= %(today)s
+               AND history.school_id IS DISTINCT FROM line.school_id
+        """, params)
+        self.invalidate_model()
+
+    @api.model
+    def _seed_from_rosters(self):
+        """ Create the history of the roster entries that have none yet, starting at the course line start """
+        self._flush_enrollment_sources()
+        self.env.cr.execute("""
+            SELECT rel.course_line_id, rel.student_id
+              FROM course_line_student_rel rel
+             WHERE NOT EXISTS (
+                    SELECT 1 FROM school_enrollment_history history
+                     WHERE history.course_line_id = rel.course_line_id
+                       AND history.student_id = rel.student_id)
+        """)
+        pairs = self.env.cr.fetchall()
+        self._open_periods(pairs, from_today=False)
+        if pairs:
+            _logger.info(f"Historial de matrículas inicializado con {len(pairs)} registros")
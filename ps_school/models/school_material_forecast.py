@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import api, fields, models
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Shortages further away than this are not forecast, also keeps the date within the supported range
+FORECAST_HORIZON_WEEKS = 520
+
+
+class SchoolMaterialForecast(models.Model):
+    """ Loss rate of every product of every box, estimated from the whole movement history, with the
+    date the box is expected to fall below its expected quantity. Rebuilt every night."""
+    _name = 'school.material.forecast'
+    _description = 'Material consumption forecast'
+    _order = 'shortage_date, box_id, product_id'
+
+    box_id = fields.Many2one(comodel_name='school.box', string='Caja', required=True, ondelete='cascade',
+                             index=True)
+    product_id = fields.Many2one(comodel_name='product.product', string='Producto', required=True,
+                                 ondelete='cascade')
+    expected_quantity = fields.Integer(string='Cantidad esperada')
+    real_quantity = fields.Integer(string='Cantidad real')
+    lost_quantity = fields.Integer(string='Cantidad perdida')
+    attendance_count = fields.Integer(string='Asistencias')
+    weeks_observed = fields.Float(string='Semanas observadas', digits=(16, 1))
+    loss_per_week = fields.Float(string='Pérdida por semana', digits=(16, 2))
+    loss_per_attendance = fields.Float(string='Pérdida por asistencia', digits=(16, 2))
+    shortage_date = fields.Date(string='Fecha estimada de faltante',
+                                help="Fecha en la que se estima que la caja quedará por debajo de la cantidad esperada")
+
+    @api.model
+    def refresh_forecasts(self):
+        """
+        Rebuild the forecast of every (box, product) pair. Loss totals, observation windows and
+        attendance counts of the whole history are aggregated by a single query, and the
+        forecasts are replaced with a single create.
+        """
+        course_line_boxes = self.env['school.course.line']._fields['box_ids']
+        self.env.flush_all()
+        self.env.cr.execute(f"""
+            WITH box_start AS (
+                SELECT movement.box_id, MIN(COALESCE(movement.date, movement.create_date)) AS first_date
+                  FROM school_material_movement movement
+              GROUP BY movement.box_id
+            ), product_loss AS (
+                SELECT movement.box_id, movement.product_id, -SUM(movement.qty) AS lost_qty
+                  FROM school_material_movement movement
+                 WHERE movement.movement_type = 'loss'
+              GROUP BY movement.box_id, movement.product_id
+            ), box_attendance AS (
+                SELECT rel.{course_line_boxes.column2} AS box_id, COUNT(attendance.id) AS attendance_count
+                  FROM {course_line_boxes.relation} rel
+                  JOIN school_attendance attendance
+                    ON attendance.course_line_id = rel.{course_line_boxes.column1}
+                  JOIN box_start ON box_start.box_id = rel.{course_line_boxes.column2}
+                 WHERE attendance.date >= box_start.first_date::date
+                   AND attendance.date <= CURRENT_DATE
+              GROUP BY rel.{course_line_boxes.column2}
+            )
+            SELECT line.box_id,
+                   line.product_id,
+                   COALESCE(line.expected_quantity, 0),
+                   COALESCE(line.real_quantity, 0),
+                   COALESCE(product_loss.lost_qty, 0),
+                   COALESCE(box_attendance.attendance_count, 0),
+                   GREATEST(EXTRACT(EPOCH FROM (NOW() AT TIME ZONE 'UTC' - box_start.first_date))::float / 604800.0, 1)
+              FROM school_box_line line
+              JOIN box_start ON box_start.box_id = line.box_id
+         LEFT JOIN product_loss ON product_loss.box_id = line.box_id
+                               AND product_loss.product_id = line.product_id
+         LEFT JOIN box_attendance ON box_attendance.box_id = line.box_id
+             WHERE line.product_id IS NOT NULL
+        """)
+        rows = self.env.cr.fetchall()
+
+        today = fields.Date.today()
+        vals_list = []
+        for box_id, product_id, expected_qty, real_qty, lost_qty, attendance_count, weeks in rows:
+            weeks = float(weeks)
+            loss_per_week = lost_qty / weeks
+            shortage_date = False
+            if real_qty < expected_qty:
+                shortage_date = today
+            elif loss_per_week > 0:
+                # Units to lose before being one below the expected quantity
+                shortage_weeks = (real_qty - expected_qty + 1) / loss_per_week
+                if shortage_weeks <= FORECAST_HORIZON_WEEKS:
+                    shortage_date = today + timedelta(weeks=shortage_weeks)
+            vals_list.append({
+                'box_id': box_id,
+                'product_id': product_id,
+                'expected_quantity': expected_qty,
+                'real_quantity': real_qty,
+                'lost_quantity': lost_qty,
+                'attendance_count': attendance_count,
+                'weeks_observed': weeks,
+                'loss_per_week': loss_per_week,
+                'loss_per_attendance': lost_qty / attendance_count if attendance_count else 0.0,
+                'shortage_date': shortage_date,
+            })
+
+        self.search([]).unlink()
+        forecasts = self.create(vals_list)
+        _logger.info(f"Calculadas {len(forecasts)} previsiones de consumo de materiales")
+        return forecasts
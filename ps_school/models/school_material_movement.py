@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 
 
 # Nuevo modelo para gestionar movimientos de materiales
@@ -16,6 +16,8 @@ class SchoolMaterialMovement(models.Model):
     )
 
     attendance_id = fields.Many2one(comodel_name='school.attendance', string='Asistencia')
+    material_line_id = fields.Many2one(comodel_name='school.attendance.material.line',
+                                       string='Línea de materiales de la asistencia', ondelete='set null')
     product_id = fields.Many2one(
         comodel_name='product.product',
         string='Producto',
@@ -47,3 +49,95 @@ class SchoolMaterialMovement(models.Model):
         related='attendance_id.school_id',
         string='Escuela',
     )
+
+    def init(self):
+        tools.create_index(self.env.cr, 'school_material_movement_box_product_date_idx',
+                           self._table, ['box_id', 'product_id', 'date'])
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        # Bulk loaders recompute the balances themselves once the whole load is done
+        if not self.env.context.get('defer_box_balances'):
+            self._update_box_balances(records._get_box_product_dates())
+        return records
+
+    def write(self, vals):
+        if not {'qty', 'box_id', 'product_id', 'date'} & set(vals):
+            return super().write(vals)
+        pair_dates = self._get_box_product_dates()
+        result = super().write(vals)
+        for pair, date in self._get_box_product_dates().items():
+            pair_dates[pair] = min(pair_dates.get(pair, date), date)
+        self._update_box_balances(pair_dates)
+        return result
+
+    def unlink(self):
+        pair_dates = self._get_box_product_dates()
+        result = super().unlink()
+        self._update_box_balances(pair_dates)
+        return result
+
+    def _get_box_product_dates(self):
+        """Return the earliest movement date of every (box_id, product_id) pair affected by the movements"""
+        pair_dates = {}
+        for movement in self:
+            pair = (movement.box_id.id, movement.product_id.id)
+            date = movement.date or movement.create_date
+            pair_dates[pair] = min(pair_dates.get(pair, date), date)
+        return pair_dates
+
+    @api.model
+    def _update_box_balances(self, pair_dates):
+        """Drop the snapshots and recompute the box lines affected by changed movements"""
+        self.env['school.material.snapshot'].sudo()._drop_snapshots_after(pair_dates)
+        self.env['school.box.line']._recompute_real_quantity(set(pair_dates))
+
+    @api.model
+    def _get_balances(self, box_ids, product_ids=None, as_of=None):
+        """
+        Compute the material balance of the given boxes, optionally as of a given datetime, with a
+        single query: the latest snapshot of each (box, product) pair plus the movements after it.
+
+        :return: dict mapping (box_id, product_id) pairs to their quantity
+        """
+        if not box_ids:
+            return {}
+        self.flush_model(['box_id', 'product_id', 'qty', 'date'])
+        self.env['school.material.snapshot'].flush_model(['box_id', 'product_id', 'qty', 'date'])
+
+        params = {'box_ids': list(box_ids), 'product_ids': list(product_ids or []), 'as_of': as_of}
+        snapshot_where = "snapshot.box_id = ANY(%(box_ids)s)"
+        movement_where = "movement.box_id = ANY(%(box_ids)s)"
+        if product_ids is not None:
+            snapshot_where += " AND snapshot.product_id = ANY(%(product_ids)s)"
+            movement_where += " AND movement.product_id = ANY(%(product_ids)s)"
+        if as_of:
+            snapshot_where += " AND snapshot.date <= %(as_of)s"
+            movement_where += " AND COALESCE(movement.date, movement.create_date) <= %(as_of)s"
+
+        self.env.cr.execute(f"""
+            WITH last_snapshot AS (
+                SELECT DISTINCT ON (snapshot.box_id, snapshot.product_id)
+                       snapshot.box_id, snapshot.product_id, snapshot.date, snapshot.qty
+                  FROM school_material_snapshot snapshot
+                 WHERE {snapshot_where}
+              ORDER BY snapshot.box_id, snapshot.product_id, snapshot.date DESC
+            ), recent_movement AS (
+                SELECT movement.box_id, movement.product_id, SUM(movement.qty) AS qty
+                  FROM school_material_movement movement
+             LEFT JOIN last_snapshot ON last_snapshot.box_id = movement.box_id
+                                    AND last_snapshot.product_id = movement.product_id
+                 WHERE {movement_where}
+                   AND (last_snapshot.date IS NULL
+                        OR COALESCE(movement.date, movement.create_date) > last_snapshot.date)
+              GROUP BY movement.box_id, movement.product_id
+            )
+            SELECT COALESCE(last_snapshot.box_id, recent_movement.box_id),
+                   COALESCE(last_snapshot.product_id, recent_movement.product_id),
+                   COALESCE(last_snapshot.qty, 0) + COALESCE(recent_movement.qty, 0)
+              FROM last_snapshot
+         FULL JOIN recent_movement ON recent_movement.box_id = last_snapshot.box_id
+                                  AND recent_movement.product_id = last_snapshot.product_id
+        """, params)
+        return {(box_id, product_id): qty for box_id, product_id, qty in self.env.cr.fetchall()}
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models, tools
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class SchoolMaterialSnapshot(models.Model):
+    """ Balance checkpoint of a product inside a box, so balances are read from the latest snapshot
+    plus the movements after it instead of the full movement history."""
+    _name = 'school.material.snapshot'
+    _description = 'Material balance snapshot'
+    _order = 'date desc, id desc'
+    _sql_constraints = [
+        ('box_product_date_uniq', 'unique(box_id, product_id, date)',
+         'Ya existe una instantánea de este producto en esta caja para esta fecha.'),
+    ]
+
+    box_id = fields.Many2one(comodel_name='school.box', string='Caja', required=True, ondelete='cascade')
+    product_id = fields.Many2one(comodel_name='product.product', string='Producto', required=True,
+                                 ondelete='cascade')
+    date = fields.Datetime(string='Fecha', required=True)
+    # Balance including every movement up to the snapshot date
+    qty = fields.Integer(string='Cantidad')
+
+    def init(self):
+        tools.create_index(self.env.cr, 'school_material_snapshot_box_product_date_idx',
+                           self._table, ['box_id', 'product_id', 'date DESC'])
+
+    @api.model
+    def _drop_snapshots_after(self, pair_dates):
+        """
+        Remove the snapshots made stale by a movement dated before them.
+
+        :param pair_dates: dict mapping (box_id, product_id) pairs to the earliest changed movement date
+        """
+        if not pair_dates:
+            return
+        snapshots = self.search([
+            ('box_id', 'in', list({box_id for box_id, _product_id in pair_dates})),
+            ('product_id', 'in', list({product_id for _box_id, product_id in pair_dates})),
+            ('date', '>=', min(pair_dates.values())),
+        ])
+        snapshots.filtered(
+            lambda snapshot: (snapshot.box_id.id, snapshot.product_id.id) in pair_dates
+            and snapshot.date >= pair_dates[(snapshot.box_id.id, snapshot.product_id.id)]
+        ).unlink()
+
+    @api.model
+    def create_snapshots(self):
+        """
+        Create a snapshot at the current date for every (box, product) pair that has movements
+        after its latest snapshot, all of them with a single query and a single create.
+        """
+        cutoff = fields.Datetime.now()
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT DISTINCT movement.box_id, movement.product_id
+              FROM school_material_movement movement
+             WHERE COALESCE(movement.date, movement.create_date) <= %(cutoff)s
+               AND NOT EXISTS (
+                    SELECT 1 FROM school_material_snapshot snapshot
+                     WHERE snapshot.box_id = movement.box_id
+                       AND snapshot.product_id = movement.product_id
+                       AND snapshot.date >= COALESCE(movement.date, movement.create_date))
+        """, {'cutoff': cutoff})
+        pairs = set(self.env.cr.fetchall())
+        if not pairs:
+            return self
+
+        balances = self.env['school.material.movement']._get_balances(
+            list({box_id for box_id, _product_id in pairs}),
+            list({product_id for _box_id, product_id in pairs}),
+            as_of=cutoff,
+        )
+        snapshots = self.create([{
+            'box_id': box_id,
+            'product_id': product_id,
+            'date': cutoff,
+            'qty': balances.get((box_id, product_id), 0),
+        } for box_id, product_id in pairs])
+
+        _logger.info(f"Creadas {len(snapshots)} instantáneas de materiales")
+        return snapshots
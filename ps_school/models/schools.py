@@ -24,12 +24,12 @@ class School(models.Model):
 
     @api.depends('course_line_ids.student_ids', 'course_line_ids.student_ids.enrollment_state')
     def _compute_student_qty(self):
+        if self.env['school.bulk.import']._defer_if_importing(self, 'student_qty'):
+            self.student_qty = self.active_student_qty = self.inactive_student_qty = 0
+            return
+        counts = self.env['school.course.line']._get_student_counts('course_line.school_id', self._origin.ids)
         for school in self:
-            school.student_qty = len(school.course_line_ids.mapped('student_ids'))
-            school.active_student_qty = len(
-                school.course_line_ids.mapped('student_ids').filtered(lambda s: s.enrollment_state == 'active'))
-            school.inactive_student_qty = len(
-                school.course_line_ids.mapped('student_ids').filtered(lambda s: s.enrollment_state == 'inactive'))
+            school.student_qty, school.active_student_qty, school.inactive_student_qty = counts.get(school._origin.id, (0, 0, 0))
 
     def action_create_school_invoice(self):
         for record in self:
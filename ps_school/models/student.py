@@ -6,6 +6,9 @@ from odoo.addons.base.models.res_partner import WARNING_MESSAGE, WARNING_HELP
 from odoo.exceptions import ValidationError, UserError
 from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT
 from psycopg2 import sql, DatabaseError
+import logging
+
+_logger = logging.getLogger(__name__)
 
 
 class ResPartner(models.Model):
@@ -41,7 +44,7 @@ class ResPartner(models.Model):
     # Inscription dates and state
     start_date = fields.Date(string='Fecha de alta')
     finish_date = fields.Date(string='Fecha de baja')
-    # Todo: auto change status when finish_date is reached
+    # Switched to inactive by the daily cron once finish_date has passed
     enrollment_state = fields.Selection([
         ('active', 'Alta'),
         ('inactive', 'Baja'),
@@ -76,6 +79,48 @@ class ResPartner(models.Model):
                 if len(record.guardian_ids.filtered(lambda g: g.invoice)) > 1:
                     raise ValidationError("Solo se puede marcar un padre para facturar.")
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override create to open the enrollment history of the students created with course lines"""
+        records = super().create(vals_list)
+        self.env['school.enrollment.history'].sudo()._open_periods(
+            [(course_line.id, record.id) for record in records for course_line in record.student_course_line_ids])
+        return records
+
+    def write(self, vals):
+        """Override write to keep the enrollment history in line with the rosters and the student dates"""
+        course_lines = {record.id: set(record.student_course_line_ids.ids) for record in self} \
+            if 'student_course_line_ids' in vals else {}
+        result = super().write(vals)
+        history = self.env['school.enrollment.history'].sudo()
+        if course_lines:
+            added, removed = [], []
+            for record in self:
+                course_line_ids = set(record.student_course_line_ids.ids)
+                added += [(course_line_id, record.id) for course_line_id in course_line_ids - course_lines[record.id]]
+                removed += [(course_line_id, record.id) for course_line_id in course_lines[record.id] - course_line_ids]
+            history._close_periods(removed)
+            history._open_periods(added)
+        if 'start_date' in vals or 'finish_date' in vals:
+            history._refresh_periods(student_ids=self.ids)
+        return result
+
+    @api.model
+    def update_enrollment_states(self):
+        """
+        Cron: mark as inactive (baja) every active student whose finish date has passed. All of them are
+        written at once, so the student counters of their course lines and schools are recomputed
+        a single time through their dependencies on enrollment_state.
+        """
+        students = self.search([
+            ('finish_date', '<', fields.Date.context_today(self)),
+            ('enrollment_state', '=', 'active'),
+        ])
+        if students:
+            students.write({'enrollment_state': 'inactive'})
+            _logger.info(f"Dados de baja {len(students)} estudiantes con fecha de baja pasada")
+        return students
+
     @api.depends('school_role', 'employee_ids', 'employee_ids.is_teacher')
     def _compute_school_role(self):
         for record in self:
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+from . import school_box_reconciliation_report
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from odoo import fields, models, tools
+
+
+class SchoolBoxReconciliationReport(models.Model):
+    """ Read-only view with the expected and real quantity of every product of every box, with the
+    school and teachers of the box, to find the short boxes of the whole fleet in a single query.
+    There is a single row per box line, so the quantities can be summed across the fleet. The
+    quantities are read from the balances stored on the box lines."""
+    _name = 'school.box.reconciliation.report'
+    _description = 'Box reconciliation report'
+    _auto = False
+    _order = 'difference, box_id, product_id'
+
+    box_id = fields.Many2one(comodel_name='school.box', string='Caja', readonly=True)
+    product_id = fields.Many2one(comodel_name='product.product', string='Producto', readonly=True)
+    # A box shared by several schools is reported under the first one of them
+    school_id = fields.Many2one(comodel_name='res.partner', string='Escuela', readonly=True)
+    # Likewise a box with several teachers is grouped under the first one, all of them can be searched
+    teacher_id = fields.Many2one(comodel_name='hr.employee', string='Profesor', readonly=True)
+    teacher_ids = fields.Many2many(related='box_id.teacher_ids', string='Profesores')
+    expected_quantity = fields.Integer(string='Cantidad esperada', readonly=True)
+    real_quantity = fields.Integer(string='Cantidad real', readonly=True)
+    difference = fields.Integer(string='Diferencia', readonly=True)
+
+    def init(self):
+        course_line_boxes = self.env['school.course.line']._fields['box_ids']
+        box_teachers = self.env['school.box']._fields['teacher_ids']
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                SELECT line.id,
+                       line.box_id,
+                       line.product_id,
+                       box_school.school_id,
+                       box_teacher.teacher_id,
+                       line.expected_quantity,
+                       COALESCE(line.real_quantity, 0) AS real_quantity,
+                       COALESCE(line.quantity_difference, 0) AS difference
+                  FROM school_box_line line
+             LEFT JOIN (
+                        SELECT rel.{course_line_boxes.column2} AS box_id, MIN(course_line.school_id) AS school_id
+                          FROM {course_line_boxes.relation} rel
+                          JOIN school_course_line course_line ON course_line.id = rel.{course_line_boxes.column1}
+                      GROUP BY rel.{course_line_boxes.column2}
+                       ) box_school ON box_school.box_id = line.box_id
+             LEFT JOIN (
+                        SELECT rel.{box_teachers.column1} AS box_id, MIN(rel.{box_teachers.column2}) AS teacher_id
+                          FROM {box_teachers.relation} rel
+                      GROUP BY rel.{box_teachers.column1}
+                       ) box_teacher ON box_teacher.box_id = line.box_id
+                 WHERE line.box_id IS NOT NULL
+                   AND line.product_id IS NOT NULL
+            )
+        """)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from odoo import Command, fields
+from odoo.tests import common
+
+
+class TestMaterialForecast(common.TransactionCase):
+    def setUp(self):
+        super().setUp()
+
+        self.today = fields.Date.today()
+        self.product = self.env["product.product"].create({"name": "Motor"})
+        self.box = self.env["school.box"].create({
+            "name": "Caja forecast",
+            "box_line_ids": [Command.create({"product_id": self.product.id, "expected_quantity": 5})],
+        })
+        self.Movement = self.env["school.material.movement"]
+        self.Movement.create({
+            "box_id": self.box.id,
+            "product_id": self.product.id,
+            "qty": 20,
+            "movement_type": "increment",
+            "date": fields.Datetime.now() - timedelta(weeks=4),
+        })
+
+    def _get_forecast(self):
+        self.env["school.material.forecast"].refresh_forecasts()
+        return self.env["school.material.forecast"].search([
+            ("box_id", "=", self.box.id),
+            ("product_id", "=", self.product.id),
+        ])
+
+    def test_forecast_with_loss(self):
+        self.Movement.create({
+            "box_id": self.box.id,
+            "product_id": self.product.id,
+            "qty": -4,
+            "movement_type": "loss",
+        })
+
+        forecast = self._get_forecast()
+
+        self.assertEqual(forecast.lost_quantity, 4)
+        self.assertAlmostEqual(forecast.loss_per_week, 1.0, places=1)
+        # 16 units left, 12 to lose before falling below the 5 expected
+        self.assertTrue(self.today + timedelta(weeks=11) <= forecast.shortage_date <= self.today + timedelta(weeks=13))
+
+    def test_forecast_beyond_horizon(self):
+        self.Movement.create({
+            "box_id": self.box.id,
+            "product_id": self.product.id,
+            "qty": 10 ** 6,
+            "movement_type": "increment",
+        })
+        self.Movement.create({
+            "box_id": self.box.id,
+            "product_id": self.product.id,
+            "qty": -1,
+            "movement_type": "loss",
+        })
+
+        forecast = self._get_forecast()
+
+        self.assertTrue(forecast.loss_per_week > 0)
+        self.assertFalse(forecast.shortage_date)
+
+    def test_forecast_short_box(self):
+        self.Movement.create({
+            "box_id": self.box.id,
+            "product_id": self.product.id,
+            "qty": -18,
+            "movement_type": "loss",
+        })
+
+        self.assertEqual(self._get_forecast().shortage_date, self.today)
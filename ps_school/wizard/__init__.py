@@ -1,3 +1,6 @@
 # -*- coding: utf-8 -*-
 from . import adjust_box_material
-from . import attendance_adjust_box_material
\ No newline at end of file
+from . import attendance_adjust_box_material
+from . import attendance_backfill
+from . import import_material_movement
+from . import replenishment_planner
\ No newline at end of file
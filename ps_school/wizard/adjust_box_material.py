@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models
+from odoo import api, fields, models, Command
 from odoo.exceptions import ValidationError
 
 
@@ -9,44 +9,61 @@ class RefillBoxMaterial(models.TransientModel):
 
     box_id = fields.Many2one(comodel_name='school.box', string='Caja', required=True)
     box_product_ids = fields.Many2many(related='box_id.products_ids', string='Productos de la caja')
-    product_id = fields.Many2one(comodel_name='product.product', string='Producto', required=True)
-
-    qty = fields.Integer(string='Cantitad', required=True)
-    movement_type = fields.Selection([
-        ('loss', 'Pérdida'),
-        ('increment', 'Reposición'),
-    ], string='Tipo de movimiento', default='loss', required=True)
+    line_ids = fields.One2many(comodel_name='adjust.box.material.line', inverse_name='wizard_id',
+                               string='Productos')
 
     notes = fields.Text(string="Notas")
 
     @api.onchange('box_id')
     def _onchange_box_id(self):
-        self.product_id = False
-        if self.box_id:
-            product_ids = self.box_id.products_ids
-            return {'domain': {'product_id': [('id', 'in', product_ids)]}}
-        return {'domain': {'product_id': []}}
+        # One line per product of the box, only the ones with a quantity will be applied
+        self.line_ids = [Command.clear()] + [Command.create({
+            'product_id': product.id,
+        }) for product in self.box_id.products_ids]
 
     def action_confirm(self):
-        self.ensure_one()
-        if not self.box_id:
-            return
-
-        if self.qty <= 0:
-            raise ValidationError('La cantidad debe ser mayor a cero.')
-
-        self._create_movement_line()
+        self._create_movement_lines()
 
         return {'type': 'ir.actions.act_window_close'}
 
-    def _create_movement_line(self):
+    def _create_movement_lines(self):
         """
-        Create a new material movement line
+        Create the material movements of every line with a quantity, for all the wizards in a
+        single create so the box balance is recomputed once per submission
         """
-        self.env['school.material.movement'].create({
-            'box_id': self.box_id.id,
+        self.env['school.material.movement'].create([
+            dict(line._prepare_movement_vals(), box_id=wizard.box_id.id, notes=wizard.notes)
+            for wizard in self for line in wizard.line_ids._get_lines_to_apply()
+        ])
+
+
+class RefillBoxMaterialLine(models.TransientModel):
+    _name = 'adjust.box.material.line'
+    _description = 'Línea del wizard para reponer productos'
+
+    wizard_id = fields.Many2one(comodel_name='adjust.box.material', string='Ajuste de caja', ondelete='cascade')
+    attendance_wizard_id = fields.Many2one(comodel_name='attendance.adjust.box.material',
+                                           string='Ajuste de asistencia', ondelete='cascade')
+    product_id = fields.Many2one(comodel_name='product.product', string='Producto', required=True)
+    qty = fields.Integer(string='Cantitad')
+    movement_type = fields.Selection([
+        ('loss', 'Pérdida'),
+        ('increment', 'Reposición'),
+    ], string='Tipo de movimiento', default='loss', required=True)
+
+    def _get_lines_to_apply(self):
+        """Return the lines with a quantity to apply, the ones left at zero are ignored"""
+        if any(line.qty < 0 for line in self):
+            raise ValidationError('La cantidad debe ser mayor a cero.')
+        lines = self.filtered('qty')
+        if not lines:
+            raise ValidationError('Indique la cantidad de al menos un producto.')
+        return lines
+
+    def _prepare_movement_vals(self):
+        self.ensure_one()
+        return {
             'product_id': self.product_id.id,
             'qty': self.qty if self.movement_type == 'increment' else -self.qty,
             'movement_type': self.movement_type,
-            'notes': self.notes,
-        })
+        }
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+from odoo.exceptions import ValidationError
+
+
+class AttendanceBackfill(models.TransientModel):
+    _name = 'school.attendance.backfill'
+    _description = 'Wizard para generar asistencias de días pasados'
+
+    date_from = fields.Date(string='Desde', required=True)
+    date_to = fields.Date(string='Hasta', required=True, default=fields.Date.today)
+
+    @api.constrains('date_from', 'date_to')
+    def _check_dates(self):
+        """ Verify that the end date is not before the start date """
+        for record in self:
+            if record.date_from and record.date_to and record.date_to < record.date_from:
+                raise ValidationError('La fecha final debe ser posterior a la fecha inicial.')
+
+    def action_confirm(self):
+        """
+        Save the range as backfill checkpoint and trigger the backfill cron, so the attendances are
+        generated by the cron worker in chunks instead of inside this request
+        """
+        self.ensure_one()
+        self.env['school.attendance']._start_attendance_backfill(self.date_from, self.date_to)
+        self.env.ref('ps_school.oe_attendance_backfill_cron').sudo()._trigger()
+
+        return {'type': 'ir.actions.act_window_close'}
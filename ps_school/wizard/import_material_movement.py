@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+from itertools import islice
+
+from odoo import fields, models
+from odoo.exceptions import UserError
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ImportMaterialMovement(models.TransientModel):
+    _name = 'import.material.movement'
+    _description = 'Wizard para importar movimientos de materiales'
+
+    file = fields.Binary(string='Archivo CSV', required=True)
+    filename = fields.Char(string='Nombre del archivo')
+    mode = fields.Selection([
+        ('movement', 'Movimientos'),
+        ('count', 'Recuento físico'),
+    ], string='Tipo de importación', default='count', required=True,
+        help="Movimientos: la columna qty es el cambio de cantidad.\n"
+             "Recuento físico: la columna qty es la cantidad contada en la caja y se crea el movimiento "
+             "con la diferencia respecto a la cantidad actual, con la fecha de hoy.")
+    delimiter = fields.Char(string='Separador', default=',', required=True)
+    chunk_size = fields.Integer(string='Tamaño del lote', default=1000, required=True)
+    notes = fields.Text(string='Notas', help="Observaciones para las filas que no tengan la columna notes")
+
+    def action_import(self):
+        """
+        Import the CSV file with the columns box, product and qty, and optionally movement_type,
+        date (movement mode only) and notes. Boxes are matched by name or id and products by
+        internal reference, barcode, name or id. Rows are read and inserted in chunks, with the
+        balance of every affected (box, product) pair recomputed once at the end.
+        """
+        self.ensure_one()
+        if self.chunk_size <= 0:
+            raise UserError("El tamaño del lote debe ser mayor que cero.")
+        box_map, product_map = self._get_reference_maps()
+        Movement = self.env['school.material.movement'].with_context(
+            defer_box_balances=True, defer_box_alerts=True)
+
+        reader = csv.DictReader(
+            io.TextIOWrapper(io.BytesIO(base64.b64decode(self.file)), encoding='utf-8-sig'),
+            delimiter=self.delimiter,
+        )
+        missing_columns = {'box', 'product', 'qty'} - set(reader.fieldnames or [])
+        if missing_columns:
+            raise UserError(f"Faltan las columnas: {', '.join(sorted(missing_columns))}")
+
+        pair_dates = {}
+        created_count = 0
+        row_number = 1
+        while True:
+            rows = list(islice(reader, self.chunk_size))
+            if not rows:
+                break
+
+            vals_list, errors = self._prepare_chunk_vals(rows, row_number, box_map, product_map)
+            if errors:
+                raise UserError("No se ha importado ningún movimiento:\n" + "\n".join(errors[:20]))
+            row_number += len(rows)
+
+            movements = Movement.create(vals_list)
+            created_count += len(movements)
+            for pair, date in movements._get_box_product_dates().items():
+                pair_dates[pair] = min(pair_dates.get(pair, date), date)
+
+        Movement._update_box_balances(pair_dates)
+        _logger.info(f"Importados {created_count} movimientos de materiales para {len(pair_dates)} productos en cajas")
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': 'Importación completada',
+                'message': f'Se han creado {created_count} movimientos de materiales.',
+                'type': 'success',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+
+    def _get_reference_maps(self):
+        """
+        Preload the box and product references accepted in the file, mapped to their ids. References
+        shared by several boxes or products (same name, a code equal to another id...) are mapped to
+        False, so the rows using them are reported instead of being posted to an arbitrary record.
+        """
+        def add_reference(reference_map, reference, record_id):
+            if reference:
+                if reference_map.get(reference, record_id) != record_id:
+                    reference_map[reference] = False
+                else:
+                    reference_map[reference] = record_id
+
+        box_map = {}
+        for box in self.env['school.box'].search_fetch([], ['name']):
+            add_reference(box_map, str(box.id), box.id)
+            add_reference(box_map, box.name, box.id)
+
+        product_map = {}
+        for product in self.env['product.product'].search_fetch([], ['name', 'default_code', 'barcode']):
+            for reference in (str(product.id), product.name, product.barcode, product.default_code):
+                add_reference(product_map, reference, product.id)
+        return box_map, product_map
+
+    def _prepare_chunk_vals(self, rows, first_row_number, box_map, product_map):
+        """
+        Validate a chunk of rows against the preloaded references and build the movement values.
+        In count mode, the balances of the boxes of the chunk are read with a single query.
+
+        :return: tuple of the movement values list and the list of error messages
+        """
+        vals_list = []
+        errors = []
+        parsed_rows = []
+        for row_number, row in enumerate(rows, start=first_row_number + 1):
+            box_reference = (row.get('box') or '').strip()
+            product_reference = (row.get('product') or '').strip()
+            box_id = box_map.get(box_reference)
+            product_id = product_map.get(product_reference)
+            movement_type = (row.get('movement_type') or '').strip()
+            try:
+                qty = int((row.get('qty') or '').strip())
+            except ValueError:
+                errors.append(f"Fila {row_number}: cantidad no válida '{row.get('qty')}'")
+                continue
+            date = False
+            if (row.get('date') or '').strip() and self.mode == 'count':
+                # Counts are compared with the current balance, a past date would post them at the wrong point
+                errors.append(f"Fila {row_number}: el recuento físico no admite fecha '{row.get('date')}'")
+            elif (row.get('date') or '').strip():
+                try:
+                    date = fields.Datetime.to_datetime(row['date'].strip())
+                except ValueError:
+                    errors.append(f"Fila {row_number}: fecha no válida '{row.get('date')}'")
+            if box_reference in box_map and not box_id:
+                errors.append(f"Fila {row_number}: referencia de caja ambigua '{row.get('box')}'")
+            elif not box_id:
+                errors.append(f"Fila {row_number}: caja no encontrada '{row.get('box')}'")
+            if product_reference in product_map and not product_id:
+                errors.append(f"Fila {row_number}: referencia de producto ambigua '{row.get('product')}'")
+            elif not product_id:
+                errors.append(f"Fila {row_number}: producto no encontrado '{row.get('product')}'")
+            if movement_type and movement_type not in ('loss', 'increment'):
+                errors.append(f"Fila {row_number}: tipo de movimiento no válido '{movement_type}'")
+            if self.mode == 'count' and qty < 0:
+                errors.append(f"Fila {row_number}: la cantidad contada no puede ser negativa")
+            if box_id and product_id:
+                parsed_rows.append((box_id, product_id, qty, movement_type, date, row))
+
+        if errors:
+            return vals_list, errors
+
+        balances = {}
+        if self.mode == 'count':
+            balances = self.env['school.material.movement']._get_balances(
+                list({box_id for box_id, *_rest in parsed_rows}))
+
+        for box_id, product_id, qty, movement_type, date, row in parsed_rows:
+            if self.mode == 'count':
+                # Movement with the difference between the count and the current balance
+                counted_qty = qty
+                qty = counted_qty - balances.get((box_id, product_id), 0)
+                balances[(box_id, product_id)] = counted_qty
+                if not qty:
+                    continue
+                movement_type = 'increment' if qty > 0 else 'loss'
+            elif movement_type:
+                qty = abs(qty) if movement_type == 'increment' else -abs(qty)
+            else:
+                movement_type = 'increment' if qty > 0 else 'loss'
+
+            vals = {
+                'box_id': box_id,
+                'product_id': product_id,
+                'qty': qty,
+                'movement_type': movement_type,
+                'notes': (row.get('notes') or '').strip() or self.notes,
+            }
+            if date:
+                vals['date'] = date
+            vals_list.append(vals)
+
+        return vals_list, errors
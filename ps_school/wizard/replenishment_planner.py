@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+
+from odoo import api, fields, models, Command
+from odoo.exceptions import UserError
+
+
+class ReplenishmentPlanner(models.TransientModel):
+    _name = 'school.replenishment.planner'
+    _description = 'Planificador de reposición de materiales'
+
+    school_ids = fields.Many2many(comodel_name='res.partner', string='Escuelas', domain=[('is_school', '=', True)])
+    teacher_ids = fields.Many2many(comodel_name='hr.employee', string='Profesores', domain=[('is_teacher', '=', True)])
+    line_ids = fields.One2many(
+        comodel_name='school.replenishment.planner.line',
+        inverse_name='planner_id',
+        string='Lista de compra',
+        compute='_compute_line_ids',
+        store=True,
+    )
+
+    def _get_box_line_domain(self):
+        """Domain of the box lines below their expected quantity, restricted to the selected filters"""
+        self.ensure_one()
+        domain = [('quantity_difference', '<', 0)]
+        if self.school_ids:
+            course_lines = self.env['school.course.line'].search([('school_id', 'in', self.school_ids.ids)])
+            domain.append(('box_id', 'in', course_lines.box_ids.ids))
+        if self.teacher_ids:
+            domain.append(('box_id.teacher_ids', 'in', self.teacher_ids.ids))
+        return domain
+
+    @api.depends('school_ids', 'teacher_ids')
+    def _compute_line_ids(self):
+        """Shortfall per product across all the selected boxes, with a single grouped query"""
+        for record in self:
+            groups = self.env['school.box.line']._read_group(
+                record._get_box_line_domain(), ['product_id'], ['quantity_difference:sum', 'box_id:count_distinct'])
+            record.line_ids = [Command.clear()] + [Command.create({
+                'product_id': product.id,
+                'shortfall_qty': -difference,
+                'box_count': box_count,
+            }) for product, difference, box_count in groups]
+
+    def action_export_purchase_list(self):
+        """Download the purchase list as a CSV file"""
+        self.ensure_one()
+        if not self.line_ids:
+            raise UserError('No hay productos que reponer.')
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['Referencia', 'Producto', 'Cantidad a comprar', 'Cajas'])
+        for line in self.line_ids:
+            writer.writerow([line.product_id.default_code or '', line.product_id.display_name,
+                             line.shortfall_qty, line.box_count])
+
+        attachment = self.env['ir.attachment'].create({
+            'name': f'Lista_de_compra_{fields.Date.today()}.csv',
+            'type': 'binary',
+            'datas': base64.b64encode(buffer.getvalue().encode('utf-8-sig')),
+            'res_model': self._name,
+            'res_id': self.id,
+            'mimetype': 'text/csv',
+        })
+
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/web/content/{attachment.id}?download=true',
+            'target': 'self',
+        }
+
+    def action_create_replenishment(self):
+        """
+        Bring every selected box back to its expected quantity after restocking, with a single
+        create of replenishment movements
+        """
+        self.ensure_one()
+        box_lines = self.env['school.box.line'].search(self._get_box_line_domain())
+        if not box_lines:
+            raise UserError('No hay productos que reponer.')
+
+        self.env['school.material.movement'].create([{
+            'box_id': line.box_id.id,
+            'product_id': line.product_id.id,
+            'qty': -line.quantity_difference,
+            'movement_type': 'increment',
+            'notes': 'Reposición planificada de materiales.',
+        } for line in box_lines])
+
+        return {'type': 'ir.actions.act_window_close'}
+
+
+class ReplenishmentPlannerLine(models.TransientModel):
+    _name = 'school.replenishment.planner.line'
+    _description = 'Línea del planificador de reposición'
+    _order = 'shortfall_qty desc'
+
+    planner_id = fields.Many2one(comodel_name='school.replenishment.planner', string='Planificador',
+                                 ondelete='cascade')
+    product_id = fields.Many2one(comodel_name='product.product', string='Producto', readonly=True)
+    shortfall_qty = fields.Integer(string='Cantidad a comprar', readonly=True)
+    box_count = fields.Integer(string='Cajas', readonly=True)
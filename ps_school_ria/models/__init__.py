@@ -4,3 +4,4 @@ from . import school_grade
 from . import school_grade_line
 from . import res_partner
 from . import res_config_settings
+from . import school_course_line
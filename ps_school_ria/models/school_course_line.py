@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class SchoolCourseLine(models.Model):
+    _inherit = 'school.course.line'
+
+    def _after_enrollment_change(self, added, removed):
+        """ Sync the rosters of the draft grades of the course lines """
+        super()._after_enrollment_change(added, removed)
+        grades = self.env['school.grade'].search([('course_line_id', 'in', self.ids), ('state', '=', 'draft')])
+        grades._sync_grade_lines()
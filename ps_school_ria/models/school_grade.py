@@ -95,6 +95,27 @@ class SchoolGrade(models.Model):
             elif not record.course_line_id and record.state == 'draft':
                 record.student_ids = False
 
+    def _sync_grade_lines(self):
+        """
+        Sync the students and grade lines of the grades with the students of their course line,
+        keeping the lines of the students that stay. The lines of all the grades are created with
+        a single create and removed with a single unlink.
+        """
+        lines_to_create = []
+        lines_to_remove = self.env['school.grade.line']
+        for record in self:
+            roster = record.course_line_id.student_ids
+            if record.student_ids != roster:
+                record.student_ids = roster
+            lines_to_remove |= record.grade_line_ids.filtered(lambda line: line.student_id not in roster)
+            lines_to_create += [{
+                'grade_id': record.id,
+                'student_id': student.id,
+            } for student in roster - record.grade_line_ids.student_id]
+
+        lines_to_remove.unlink()
+        return self.env['school.grade.line'].create(lines_to_create)
+
     def action_close_grade(self):
         self.ensure_one()
         self.state = 'closed'